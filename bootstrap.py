@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Bootstrap confidence intervals for the mutual information of network edges.
+
+Resampling patients and calling mathfunc.mutual_info() for every replicate
+would multiply the runtime by the number of replicates.  Instead, a bootstrap
+replicate is represented as a vector of multinomial weights (how many times
+each patient was drawn).  For a pair of genes, each patient falls in one cell
+of the contingency table, so with a one-hot patient x cell matrix, the weighted
+contingency tables for all replicates are a single matrix product.  That is
+done for a block of pairs at once.
+
+This only makes sense for edges that passed a cutoff (use prune.read_edges()
+with a cutoff), so the cost scales with the size of the network.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import mathfunc as mf
+from prune import KINDS, read_edges
+
+# Number of values each type of node can take.
+DOMAINS = {'E': 3, 'M': 2}
+
+
+def node_values(expression, mutations, name):
+    """Return the values (as integers) and domain size for a node name."""
+    kind, gene = name.split(':', 1)
+    matrix = expression if kind == 'E' else mutations
+    return matrix[gene].values.astype(np.int64), DOMAINS[kind]
+
+
+def bootstrap_weights(replicates, npatients, seed=None):
+    """Return a (replicates, npatients) matrix of multinomial weights.
+
+    Row b says how many times each patient appears in bootstrap replicate b.
+
+    """
+    rng = np.random.RandomState(seed)
+    return rng.multinomial(npatients, np.ones(npatients) / npatients,
+                           size=replicates).astype(float)
+
+
+def weighted_counts(weights, x, y, ydomain, cells):
+    """Compute weighted contingency tables for a block of pairs.
+
+    x and y are (pairs, npatients) arrays of values.  Returns an array of shape
+    (pairs, replicates, cells), where cells is the size of the flattened
+    contingency table.
+
+    """
+    cell = x * ydomain + y
+    onehot = (cell[:, :, np.newaxis] == np.arange(cells)).astype(float)
+    return np.matmul(weights, onehot)
+
+
+def bootstrap_edges(expression, mutations, edges, replicates=1000,
+                    alpha=0.05, block=256, seed=None):
+    """Compute bootstrap confidence intervals for a list of edges.
+
+    Edges are (src, dst, mi) tuples with node names like 'E:TP53' (as returned
+    by prune.read_edges()).  Returns a DataFrame indexed by (src, dst) with the
+    mutual information and the lower and upper bounds of the 1 - alpha
+    percentile interval.
+
+    """
+    mutations = mutations.reindex(index=expression.index)
+    weights = bootstrap_weights(replicates, len(expression.index), seed)
+
+    # Pairs are grouped by their domains, so each block has the same table
+    # size.
+    groups = {}
+    for src, dst, _ in edges:
+        groups.setdefault((src[0], dst[0]), []).append((src, dst))
+
+    index = []
+    results = []
+    for (skind, dkind), pairs in groups.items():
+        xdomain, ydomain = DOMAINS[skind], DOMAINS[dkind]
+        for start in range(0, len(pairs), block):
+            chunk = pairs[start:start + block]
+            x = np.array([node_values(expression, mutations, s)[0]
+                          for s, _ in chunk])
+            y = np.array([node_values(expression, mutations, d)[0]
+                          for _, d in chunk])
+            counts = weighted_counts(weights, x, y, ydomain,
+                                     xdomain * ydomain)
+            boots = mf.mutual_info_counts(counts, xdomain, ydomain)
+            ones = np.ones((1, x.shape[1]))
+            mi = mf.mutual_info_counts(
+                weighted_counts(ones, x, y, ydomain, xdomain * ydomain),
+                xdomain, ydomain)[:, 0]
+            low, high = np.percentile(boots, [100 * alpha / 2,
+                                              100 * (1 - alpha / 2)], axis=1)
+            index.extend(chunk)
+            results.append(np.column_stack((mi, low, high)))
+        print('Bootstrapped %d %s-%s edges.' % (len(pairs), skind, dkind))
+
+    if not results:
+        return pd.DataFrame(columns=['mi', 'low', 'high'])
+    index = pd.MultiIndex.from_tuples(index, names=['src', 'dst'])
+    return pd.DataFrame(np.concatenate(results), index=index,
+                        columns=['mi', 'low', 'high'])
+
+
+def bootstrap_files(outcsv, cutoff, replicates=1000, alpha=0.05, seed=None,
+                    **csvs):
+    """Bootstrap the edges above a cutoff in experiment CSVs.
+
+    The CSVs are given as keyword arguments named for their type, like in
+    prune.prune_files().  The intervals are written to outcsv.
+
+    """
+    edges = []
+    for kind, fname in csvs.items():
+        print('Reading %s edges from %s...' % (kind, fname))
+        edges.extend(read_edges(fname, KINDS[kind], float(cutoff)))
+
+    print('Opening expression and mutation pickles...')
+    expression = pd.read_pickle('data/expression.pickle')
+    mutations = pd.read_pickle('data/mutations.pickle')
+
+    print('Bootstrapping %d edges...' % len(edges))
+    df = bootstrap_edges(expression, mutations, edges, int(replicates),
+                         float(alpha),
+                         seed=None if seed is None else int(seed))
+    df.to_csv(outcsv)
+
+
+if __name__ == '__main__':
+    from util import quick_main
+    quick_main()
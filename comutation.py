@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""Mutation-mutation mutual information, without looking at every pair.
+
+Almost every pair of genes has no patients in common with a mutation in both.
+For a pair like that, the contingency table is completely determined by how
+many patients have each gene mutated, so its mutual information can be looked
+up from a small table indexed by those two counts.  The only pairs that need
+actual counting are the ones with co-mutations, and those come straight out of
+an inverted index (patient -> mutated genes): every pair of genes mutated in
+the same patient.  So the work scales with the number of co-mutation events
+rather than with genes squared.
+
+"""
+
+import numpy as np
+import pandas as pd
+
+import mathfunc as mf
+
+
+def comutation_counts(mutations):
+    """Return every pair of genes that are mutated together in some patient.
+
+    Returns three arrays, a, b and overlap, where a > b are column indices into
+    mutations, and overlap is the number of patients with both mutated.
+
+    """
+    matrix = mutations.values.astype(bool)
+    codes = []
+    for row in matrix:
+        genes = np.nonzero(row)[0]
+        if len(genes) < 2:
+            continue
+        i, j = np.triu_indices(len(genes), k=1)
+        codes.append(genes[j] * matrix.shape[1] + genes[i])
+    if not codes:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty, empty
+    pairs, overlap = np.unique(np.concatenate(codes), return_counts=True)
+    return pairs // matrix.shape[1], pairs % matrix.shape[1], overlap
+
+
+def mm_mutual_info(overlap, na, nb, total):
+    """Compute mutation-mutation mutual information from counts.
+
+    na and nb are the number of patients with each gene mutated, and overlap
+    is the number with both.  Works elementwise on arrays.
+
+    """
+    overlap, na, nb = np.broadcast_arrays(overlap, na, nb)
+    counts = np.stack((total - na - nb + overlap, nb - overlap,
+                       na - overlap, overlap), axis=-1)
+    return mf.mutual_info_counts(counts, 2, 2)
+
+
+class CoMutation:
+    """Computes all-pairs M-M mutual information from co-mutation counts."""
+
+    def __init__(self, mutations):
+        self.genes = mutations.columns
+        self.total = len(mutations.index)
+        self.counts = mutations.values.astype(bool).sum(axis=0)
+
+        # Mutual information for pairs with no overlap, indexed by the
+        # positions of their mutation counts in self.levels.
+        self.levels, self.level = np.unique(self.counts, return_inverse=True)
+        self.disjoint = mm_mutual_info(0, self.levels[:, np.newaxis],
+                                       self.levels[np.newaxis, :], self.total)
+
+        self.a, self.b, self.overlap = comutation_counts(mutations)
+        self.mi = mm_mutual_info(self.overlap, self.counts[self.a],
+                                 self.counts[self.b], self.total)
+        self.starts = np.searchsorted(self.a, np.arange(len(self.genes) + 1))
+
+    def row(self, i):
+        """Return the mutual information between gene i and genes 0..i-1."""
+        mi = self.disjoint[self.level[i], self.level[:i]]
+        start, end = self.starts[i], self.starts[i + 1]
+        mi[self.b[start:end]] = self.mi[start:end]
+        return mi
+
+    def series(self, gene, cutoff=None):
+        """Return a Series like the mm one from all_pairs_mutual_info().
+
+        If a cutoff is given, only values at least that high are included.
+
+        """
+        i = self.genes.get_loc(gene)
+        mi = self.row(i)
+        index = self.genes[:i]
+        if cutoff is not None:
+            keep = mi >= cutoff
+            mi, index = mi[keep], index[keep]
+        return pd.Series(mi, name=gene, index=index)
+
+    def write(self, fname, cutoff=None):
+        """Write all pairs (or those above a cutoff) as an experiment CSV."""
+        with open(fname, 'w') as f:
+            for i, gene in enumerate(self.genes):
+                series = self.series(gene, cutoff)
+                lines = ['%s, %s, %f' % (gene, geneB, value)
+                         for geneB, value in series.items()]
+                if lines:
+                    print('\n'.join(lines), file=f)
+
+
+def write_mm(outcsv='data/mm.csv', cutoff=None,
+             mutationsfname='data/mutations.pickle'):
+    """Compute the mm CSV from the mutation matrix."""
+    cutoff = None if cutoff is None else float(cutoff)
+    print('Opening mutation pickle...')
+    mutations = pd.read_pickle(mutationsfname)
+    print('Counting co-mutations...')
+    comutation = CoMutation(mutations)
+    print('Found %d co-mutated pairs.  Writing %s...' %
+          (len(comutation.overlap), outcsv))
+    comutation.write(outcsv, cutoff)
+
+
+if __name__ == '__main__':
+    from util import quick_main
+    quick_main()
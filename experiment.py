@@ -26,6 +26,7 @@ class Experiment:
         self._silent = silent
         self._params = OrderedDict()
         self.__completed = 0
+        self.__failed = 0
         self.__num_configs = 0
 
     @abstractmethod
@@ -54,20 +55,34 @@ class Experiment:
         """
         pass
 
+    def initializer(self):
+        """
+        Returns the setup to run in each worker process when it starts.
+
+        This may be overridden to return a (function, args) tuple.  It is
+        useful for large data that every task needs: the args are sent to
+        each worker once, rather than being pickled along with the experiment
+        for every task (and it doesn't depend on workers being forked).  The
+        function is also called before running in serial.
+        :return: A (function, args) tuple, or None.
+        """
+        return None
+
     def configs(self):
         """Return an iterable of all configurations for the experiment."""
         return it.product(*self._params.values())
 
-    @staticmethod
-    def _err(exception):
+    def _err(self, exception):
         """
         Error callback for multiprocessing.
 
-        This function 'handles' exceptions from Processes by displaying them.
-        The run_config_wrapped() function puts tracebacks into the
-        exceptions, so that printing them here is actually meaningful.
+        This function 'handles' exceptions from Processes by displaying them,
+        and counting them so that run() can fail afterwards.  The
+        run_config_wrapped() function puts tracebacks into the exceptions, so
+        that printing them here is actually meaningful.
         :param exception: The exception thrown by run_config()
         """
+        self.__failed += 1
         print(exception)
 
     def _cb(self, retval):
@@ -118,10 +133,14 @@ class Experiment:
         """
         # Setup the class variables used during the experiment.
         self.__completed = 0
+        self.__failed = 0
 
         # Create a multiprocessing pool and add each configuration task.
         resultobjs = []
-        with mp.Pool(processes=processes) as pool:
+        init = self.initializer()
+        initializer, initargs = init if init else (None, ())
+        with mp.Pool(processes=processes, initializer=initializer,
+                     initargs=initargs) as pool:
             for configuration in self.configs():
                 resultobjs.append(pool.apply_async(self._wrapper,
                                                    (configuration,),
@@ -138,11 +157,16 @@ class Experiment:
     def __run_serial(self):
         """Runs the experiment in serial."""
         self.__completed = 0
+        self.__failed = 0
+        init = self.initializer()
+        if init:
+            init[0](*init[1])
         for config in self.configs():
             try:
                 self.result(self.task(config))
                 self.__completed += 1
             except:
+                self.__failed += 1
                 print("".join(traceback.format_exc()))
             if not self._silent:
                 print('Experiment: completed %d tasks.' % self.__completed)
@@ -150,7 +174,18 @@ class Experiment:
             print('Experiment: completed all tasks.')
 
     def run(self, mp=True, nproc=None):
+        """
+        Runs every task, in parallel or in serial.
+
+        Failed tasks are printed as they happen, and the rest of the tasks
+        still run.  Afterwards, an exception is raised if any of them failed,
+        so that incomplete results aren't mistaken for complete ones.
+        """
         if mp:
             self.__run_mp(processes=nproc)
         else:
             self.__run_serial()
+        if self.__failed:
+            raise Exception('Experiment: %d of %d tasks failed.' %
+                            (self.__failed,
+                             self.__failed + self.__completed))
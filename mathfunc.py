@@ -10,6 +10,19 @@ https://bitbucket.org/brenns10/tcga (private)
 import numpy as np
 import pandas as pd
 
+# The largest possible mutual information (in bits) between two of our
+# variables, since neither can have more than three values.
+MI_MAX = np.log2(3)
+
+# uint16 code used for a missing (NaN) value when quantizing.
+QUANT_MISSING = 65535
+
+# Size of one uint16 quantization step, in bits.  Rounding to the nearest step
+# means a quantized value is off by at most half of this, about 1.21e-5 bits.
+# For comparison, the '%f' in Storage.append() is off by up to 5e-7, and
+# float32 by about 1e-7 (its relative error is 6e-8, and MI <= 1.585).
+QUANT_STEP = MI_MAX / (QUANT_MISSING - 1)
+
 
 def entropy(ds, domain=(0, 1)):
     """
@@ -58,10 +71,12 @@ def precompute_entropy(matrix, domain):
 
 
 def pairwise_mutual_info(expression, mutations, expression_entropy,
-                         mutation_entropy, geneA, geneB):
+                         mutation_entropy, geneA, geneB, with_mm=True):
     """Compute all four mutual informations between two genes.
 
-    Params: the two matrices, the entropy caches, and the two genes.
+    Params: the two matrices, the entropy caches, and the two genes.  If
+    with_mm is False, the mutation-mutation mutual info is NaN (see
+    comutation.py for a much faster way to get those).
     Returns: expression-expression mutual info
              expression-mutation   mutual info
              mutation  -expression mutual info
@@ -85,13 +100,13 @@ def pairwise_mutual_info(expression, mutations, expression_entropy,
         return ae_bm
 
     ae_be = mutual_info(ae, be, aee, bee, 3, 3)
-    am_bm = mutual_info(am, bm, ame, bme, 2, 2)
+    am_bm = mutual_info(am, bm, ame, bme, 2, 2) if with_mm else np.nan
     am_be = mutual_info(am, be, ame, bee, 2, 3)
     return ae_be, ae_bm, am_be, am_bm
 
 
 def all_pairs_mutual_info(expression, mutations, expression_entropy,
-                          mutation_entropy, gene):
+                          mutation_entropy, gene, with_mm=True):
     """Compute the mutual information for all pairs starting with gene.
 
     Start with the first column in the expression dataframe, and compute all
@@ -99,7 +114,8 @@ def all_pairs_mutual_info(expression, mutations, expression_entropy,
 
     Returns four Series, in the same order as pairwise_mutual_info().  They are
     each named after this gene, so that they can be concatenated in directly
-    with a result dataframe.
+    with a result dataframe.  The with_mm argument is passed along to
+    pairwise_mutual_info().
 
     """
     ee = pd.Series(name=gene, index=expression.columns)
@@ -111,7 +127,8 @@ def all_pairs_mutual_info(expression, mutations, expression_entropy,
     for geneBidx in range(geneAidx):
         geneB = expression.columns[geneBidx]
         res = pairwise_mutual_info(expression, mutations, expression_entropy,
-                                   mutation_entropy, gene, geneB)
+                                   mutation_entropy, gene, geneB,
+                                   with_mm=with_mm)
         ee[geneB] = res[0]
         em[geneB] = res[1]
         me[geneB] = res[2]
@@ -122,3 +139,137 @@ def all_pairs_mutual_info(expression, mutations, expression_entropy,
     em[gene] = final
     me[gene] = final
     return ee, em, me, mm
+
+
+def _xlog2x(counts):
+    """Compute c * log2(c) elementwise, with 0 * log2(0) = 0."""
+    counts = np.asarray(counts, dtype=float)
+    safe = np.where(counts > 0, counts, 1)
+    return counts * np.log2(safe)
+
+
+def xlog2x_table(n):
+    """Return a lookup table of c * log2(c) for every count c from 0 to n.
+
+    With counts no bigger than the number of patients, this lets
+    mutual_info_counts() do table lookups instead of calling log2().
+
+    """
+    return _xlog2x(np.arange(n + 1))
+
+
+def mutual_info_counts(counts, xdomain, ydomain, table=None):
+    """Compute mutual information from (possibly weighted) joint counts.
+
+    The last axis of counts holds the contingency table for a pair, flattened
+    so that cell x * ydomain + y has the count for (x, y).  Any leading axes
+    are just batches of tables, so this can do lots of pairs (or bootstrap
+    replicates) at once.  Since H(X) = log2(N) - sum(c log2 c) / N, the mutual
+    information H(X) + H(Y) - H(X, Y) only needs the c log2 c sums.
+
+    If a table from xlog2x_table() is given, the counts must be integers no
+    bigger than the table, and the c log2 c values are looked up from it.
+
+    """
+    joint = np.asarray(counts)
+    joint = joint.reshape(joint.shape[:-1] + (xdomain, ydomain))
+    xlog2x = _xlog2x if table is None else table.take
+    total = joint.sum(axis=(-2, -1))
+    cells = xlog2x(joint).sum(axis=(-2, -1))
+    xmarg = xlog2x(joint.sum(axis=-1)).sum(axis=-1)
+    ymarg = xlog2x(joint.sum(axis=-2)).sum(axis=-1)
+    return (cells - xmarg - ymarg + xlog2x(total)) / total
+
+
+def quantize(mi):
+    """Quantize mutual information values to uint16 codes.
+
+    The range [0, MI_MAX] is split into steps of QUANT_STEP, so the error is
+    at most QUANT_STEP / 2 (about 1.21e-5 bits).  Codes sort in the same order
+    as the values, and NaN becomes QUANT_MISSING.
+
+    """
+    mi = np.asarray(mi, dtype=float)
+    missing = np.isnan(mi)
+    codes = np.round(np.clip(np.where(missing, 0, mi), 0, MI_MAX) / QUANT_STEP)
+    return np.where(missing, QUANT_MISSING, codes).astype(np.uint16)
+
+
+def dequantize(codes):
+    """Convert uint16 codes from quantize() back to mutual information."""
+    codes = np.asarray(codes)
+    return np.where(codes == QUANT_MISSING, np.nan, codes * QUANT_STEP)
+
+
+def cohort_mutual_info(x, y, cohort, ncohorts, xdomain, ydomain,
+                       table=None):
+    """Compute mutual information between x and many y's, for every cohort.
+
+    x is an array of values for every patient (of all cohorts stacked
+    together), y is a (patients, n) array of values for n other variables, and
+    cohort gives the cohort number of each patient.  Each patient's cohort and
+    contingency cell are combined into one code, so one bincount gives the
+    contingency tables of every pair in every cohort.  Returns an array of
+    shape (ncohorts, n).
+
+    The cell codes are int32 whenever they fit, which makes this about a third
+    faster than with int64 codes.  If a table from xlog2x_table() is given, the
+    counts are kept as uint16 (they can't be bigger than the table), and the
+    mutual information is looked up instead of calling log2().  The table
+    makes mutual_info_counts() about 25% faster, but it only saves around 5%
+    here, since the time goes into building the codes and the bincount.
+
+    """
+    x = np.asarray(x, dtype=np.int64)
+    cells = xdomain * ydomain
+    n = y.shape[1]
+    size = n * ncohorts * cells
+    dtype = np.int32 if size < 2 ** 31 else np.int64
+    code = (cohort * cells + x * ydomain).astype(dtype)[:, np.newaxis] + y
+    code += np.arange(n, dtype=dtype) * (ncohorts * cells)
+    counts = np.bincount(code.ravel(), minlength=size)
+    if table is not None and len(table) <= 2 ** 16:
+        counts = counts.astype(np.uint16)
+    counts = counts.reshape(n, ncohorts, cells)
+    return mutual_info_counts(counts, xdomain, ydomain, table).T
+
+
+def all_pairs_mutual_info_cohorts(expression, mutations, cohort, ncohorts,
+                                  geneidx, tile=1024, mm=True, table=None):
+    """Compute the mutual information for all pairs starting with a gene.
+
+    This is all_pairs_mutual_info() for several cohorts at once.  The
+    expression and mutations are (patients, genes) integer arrays with the
+    patients of every cohort stacked together, and cohort gives the cohort
+    number of each patient.  The other genes are done in tiles of columns, so
+    the work arrays stay small.  The table is passed along to
+    cohort_mutual_info().
+
+    Returns four (ncohorts, geneidx + 1) arrays in the same order as
+    pairwise_mutual_info(), with the same NaN's on the diagonal as
+    all_pairs_mutual_info().
+
+    """
+    shape = (ncohorts, geneidx + 1)
+    ee, em, me, mm_ = (np.full(shape, np.nan) for _ in range(4))
+    ae = expression[:, geneidx]
+    am = mutations[:, geneidx]
+    for start in range(0, geneidx, tile):
+        stop = min(start + tile, geneidx)
+        be = expression[:, start:stop]
+        bm = mutations[:, start:stop]
+        ee[:, start:stop] = cohort_mutual_info(ae, be, cohort, ncohorts, 3, 3,
+                                                table)
+        em[:, start:stop] = cohort_mutual_info(ae, bm, cohort, ncohorts, 3, 2,
+                                                table)
+        me[:, start:stop] = cohort_mutual_info(am, be, cohort, ncohorts, 2, 3,
+                                                table)
+        if mm:
+            mm_[:, start:stop] = cohort_mutual_info(am, bm, cohort, ncohorts,
+                                                    2, 2, table)
+
+    final = cohort_mutual_info(ae, am[:, np.newaxis], cohort, ncohorts, 3, 2,
+                               table)
+    em[:, geneidx] = final[:, 0]
+    me[:, geneidx] = final[:, 0]
+    return ee, em, me, mm_
@@ -2,10 +2,12 @@
 
 Contains an Experiment that will compute the mutual information between every
 pair of genes, mutation and expression.  It uses multiprocessing to efficiently
-distribute the load across CPU cores.
+distribute the load across CPU cores.  There is also a version that does
+several cohorts in one pass.
 
 """
 
+import os
 import pickle
 
 import pandas as pd
@@ -20,9 +22,12 @@ storage = None
 
 class MiExperiment(Experiment):
 
-    def __init__(self):
+    def __init__(self, mm=True):
         global storage
         super().__init__()
+        # When mm is False, mutation-mutation pairs are skipped, since
+        # comutation.py can compute them far faster.
+        self.mm = mm
         # Open the data files.
         print('Opening expression and mutation pickles...')
         with open('data/expression.pickle', 'rb') as f:
@@ -45,17 +50,144 @@ class MiExperiment(Experiment):
         gene = config[0]
         return mf.all_pairs_mutual_info(self.expression, self.mutations,
                                         self.expression_entropy,
-                                        self.mutation_entropy, gene)
+                                        self.mutation_entropy, gene,
+                                        with_mm=self.mm)
 
     def result(self, retval):
         ee, em, me, mm = retval
         storage.store_ee(ee)
         storage.store_em(em)
         storage.store_me(me)
-        storage.store_mm(mm)
+        if self.mm:
+            storage.store_mm(mm)
 
     def append_series(self, gene, fname, series):
         with open(fname, 'a') as f:
             for geneB in series.index:
                 if not np.isnan(series[geneB]):
                     print('%s, %s, %f' % (gene, geneB, series[geneB]), file=f)
+
+
+# Data for CohortMiExperiment.  Like storage, this is kept out of the
+# experiment object so it isn't pickled and sent along with every task; the
+# worker processes get it once, through the pool initializer.
+cohort_data = None
+cohort_storage = None
+
+
+def _set_cohort_data(data):
+    global cohort_data
+    cohort_data = data
+
+
+class CohortMiExperiment(Experiment):
+    """Computes all pairs mutual information for several cohorts at once.
+
+    Each cohort's data comes from data/<cohort>/ (see process.main_cohorts()),
+    and results are written to the CSVs in the same directory.  The patients of
+    every cohort are stacked into one matrix, and each task does one gene
+    against every earlier gene for all cohorts together, so the tiles of the
+    matrices are loaded once rather than once per cohort.
+
+    The precision can be 'float64' (the default), 'float32' or 'uint16'.  The
+    last two get the mutual information from a lookup table of n log2(n)
+    values, and the results are sent back from the workers and written as
+    binary rows of float32 values (ee.f32 and so on) or uint16 codes from
+    mathfunc.quantize() (ee.u16), instead of as CSVs.  Those are 4 or 2 bytes
+    per pair, where a CSV line takes around 30.  The codes are off by at most
+    mathfunc.QUANT_STEP / 2 (1.21e-5 bits).  Use storage.read_binary() to get
+    the pairs back (prune.read_edges() does this for you).
+
+    """
+
+    def __init__(self, cohorts, mm=True, tile=1024, precision='float64'):
+        global cohort_data, cohort_storage
+        super().__init__()
+        if precision not in ('float64', 'float32', 'uint16'):
+            raise ValueError('Bad precision "%s", must be float64, float32 or '
+                             'uint16.' % precision)
+        self.cohorts = list(cohorts)
+        self.mm = mm
+        self.tile = tile
+        self.precision = precision
+
+        print('Opening expression and mutation pickles...')
+        expressions = []
+        mutations = []
+        for cohort in self.cohorts:
+            directory = os.path.join('data', cohort)
+            expressions.append(pd.read_pickle(
+                os.path.join(directory, 'expression.pickle')))
+            mutations.append(pd.read_pickle(
+                os.path.join(directory, 'mutations.pickle'))
+                .reindex(index=expressions[-1].index))
+
+        # Use the union of the genes, and remember which ones each cohort has.
+        genes = list(expressions[0].columns)
+        known = set(genes)
+        for expression in expressions[1:]:
+            extra = sorted(set(expression.columns) - known)
+            genes.extend(extra)
+            known.update(extra)
+        self.genes = pd.Index(genes)
+        self.present = np.array([self.genes.isin(e.columns)
+                                 for e in expressions])
+
+        print('Stacking cohorts...')
+        cohort_data = {
+            'expression': np.concatenate(
+                [e.reindex(columns=self.genes).fillna(1).values
+                 .astype(np.int8) for e in expressions]),
+            'mutations': np.concatenate(
+                [m.reindex(columns=self.genes).fillna(False).values
+                 .astype(np.int8) for m in mutations]),
+            'cohort': np.concatenate(
+                [np.full(len(e.index), i, dtype=np.int64)
+                 for i, e in enumerate(expressions)]),
+        }
+
+        self.table = None
+        if precision != 'float64':
+            self.table = mf.xlog2x_table(len(cohort_data['cohort']))
+
+        print('Initializing the storage...')
+        binary = {'float32': 'f32', 'uint16': 'u16'}.get(precision)
+        cohort_storage = [Storage(self.genes, os.path.join('data', cohort),
+                                  frames=False, binary=binary)
+                          for cohort in self.cohorts]
+        self._params['gene'] = list(reversed(range(len(self.genes))))
+
+    def initializer(self):
+        return _set_cohort_data, (cohort_data,)
+
+    def task(self, config):
+        assert cohort_data is not None, 'worker was not given the cohort data'
+        geneidx = config[0]
+        results = mf.all_pairs_mutual_info_cohorts(
+            cohort_data['expression'], cohort_data['mutations'],
+            cohort_data['cohort'], len(self.cohorts), geneidx, self.tile,
+            self.mm, self.table)
+        if self.precision == 'uint16':
+            return geneidx, [mf.quantize(values) for values in results]
+        return geneidx, [values.astype(self.precision) for values in results]
+
+    def result(self, retval):
+        geneidx, (ee, em, me, mm) = retval
+        gene = self.genes[geneidx]
+        index = self.genes[:geneidx + 1]
+        for i, storage_ in enumerate(cohort_storage):
+            # Pairs with a gene the cohort doesn't have are left out.
+            if not self.present[i, geneidx]:
+                continue
+            missing = ~self.present[i, :geneidx + 1]
+            series = []
+            for values in (ee, em, me, mm):
+                values = values[i].copy()
+                values[missing] = (mf.QUANT_MISSING
+                                   if self.precision == 'uint16' else np.nan)
+                series.append(pd.Series(values, name=gene, index=index))
+            storage_.store_ee(series[0])
+            storage_.store_em(series[1])
+            storage_.store_me(series[2])
+            if self.mm:
+                storage_.store_mm(series[3])
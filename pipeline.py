@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""Runs the whole workflow, from the raw data files to the mfinder network.
+
+Each step of the workflow is a Stage with declared input and output files.  A
+stage gets a fingerprint from the contents of its inputs and its parameters,
+and it is skipped when its outputs exist and were made with the same
+fingerprint.  So, changing the cutoff only reruns the last couple of stages,
+rather than the whole (many hour) mutual information computation.
+
+"""
+
+import hashlib
+import json
+import multiprocessing as mp
+import os
+import traceback
+
+import pandas as pd
+
+_manifest = 'data/pipeline.json'
+
+
+class Stage:
+    """A step in the pipeline.
+
+    The function is called with the params and options as keyword arguments.
+    Params are part of the fingerprint, while options (like the number of
+    processes) don't change the result, so they aren't.  The function must
+    read only from the inputs and write only to the outputs, or the caching
+    will be wrong.  It has to be defined at module level, so that it can be
+    sent to another process.
+
+    Only stages marked parallel are run in a process pool alongside other
+    stages.  The rest run in the main process, since pool workers can't start
+    pools of their own (which the MI computation does).
+
+    """
+
+    def __init__(self, name, function, inputs, outputs, params=None,
+                 options=None, parallel=False):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params if params else {}
+        self.options = options if options else {}
+        self.parallel = parallel
+
+    def fingerprint(self, hashes):
+        """Return the fingerprint, given the content hashes of the inputs."""
+        # The function's module is left out, since it is '__main__' when
+        # pipeline.py is run as a script and 'pipeline' when it's imported.
+        info = {
+            'name': self.name,
+            'function': self.function.__qualname__,
+            'params': self.params,
+            'inputs': [hashes[fname] for fname in self.inputs],
+        }
+        return hashlib.sha256(json.dumps(info, sort_keys=True).encode())\
+            .hexdigest()
+
+    def run(self):
+        # Some stages (e.g. the MI computation) append to their outputs, so
+        # start from scratch.
+        for fname in self.outputs:
+            if os.path.exists(fname):
+                os.remove(fname)
+        self.function(**self.params, **self.options)
+
+
+def _run_stage(stage):
+    """Run a stage in a worker, with a readable traceback on failure."""
+    try:
+        stage.run()
+    except Exception:
+        raise Exception("".join(traceback.format_exc()))
+
+
+class Pipeline:
+    """A set of stages, run in dependency order with caching."""
+
+    def __init__(self, stages, manifest=_manifest):
+        self.stages = stages
+        self.manifest = manifest
+        if os.path.exists(manifest):
+            with open(manifest, 'r') as f:
+                self._state = json.load(f)
+        else:
+            self._state = {'files': {}, 'stages': {}}
+
+    def _save(self):
+        with open(self.manifest, 'w') as f:
+            json.dump(self._state, f, indent=2, sort_keys=True)
+
+    def file_hash(self, fname):
+        """Return the content hash of a file.
+
+        Hashing the COSMIC file takes a while, so hashes are remembered along
+        with the file's size and modification time, and only recomputed when
+        those change.
+
+        """
+        st = os.stat(fname)
+        cached = self._state['files'].get(fname)
+        if cached and cached['size'] == st.st_size and \
+                cached['mtime'] == st.st_mtime_ns:
+            return cached['sha256']
+
+        h = hashlib.sha256()
+        with open(fname, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        self._state['files'][fname] = {'size': st.st_size,
+                                       'mtime': st.st_mtime_ns,
+                                       'sha256': h.hexdigest()}
+        return h.hexdigest()
+
+    def levels(self):
+        """Group the stages into levels that can run concurrently.
+
+        A stage goes in the level after the last stage producing one of its
+        inputs.  Inputs not produced by any stage must already exist.
+
+        """
+        producer = {}
+        for stage in self.stages:
+            for fname in stage.outputs:
+                producer[fname] = stage.name
+        depth = {}
+        levels = []
+        for stage in self.stages:  # stages are given in dependency order
+            d = max([depth[producer[fname]] + 1 for fname in stage.inputs
+                     if fname in producer] + [0])
+            depth[stage.name] = d
+            if d == len(levels):
+                levels.append([])
+            levels[d].append(stage)
+        return levels
+
+    def is_current(self, stage):
+        """Return the stage's fingerprint, and whether its outputs are valid.
+
+        The outputs are valid when they all exist and were made by a run with
+        the same fingerprint.
+
+        """
+        hashes = {fname: self.file_hash(fname) for fname in stage.inputs}
+        fp = stage.fingerprint(hashes)
+        valid = self._state['stages'].get(stage.name) == fp and \
+            all(os.path.exists(fname) for fname in stage.outputs)
+        return fp, valid
+
+    def run(self, nproc=None):
+        for level in self.levels():
+            todo = []
+            for stage in level:
+                fp, valid = self.is_current(stage)
+                if valid:
+                    print('Pipeline: %s is up to date.' % stage.name)
+                else:
+                    todo.append(stage)
+
+            shared = [stage for stage in todo if stage.parallel]
+            if len(shared) > 1:
+                names = ', '.join(stage.name for stage in shared)
+                print('Pipeline: running %s concurrently...' % names)
+                with mp.Pool(processes=nproc) as pool:
+                    pool.map(_run_stage, shared, chunksize=1)
+                for stage in shared:
+                    self._record(stage)
+            else:
+                shared = []
+
+            for stage in todo:
+                if stage not in shared:
+                    print('Pipeline: running %s...' % stage.name)
+                    stage.run()
+                    self._record(stage)
+
+    def _record(self, stage):
+        """Save the fingerprint of a stage that just finished successfully.
+
+        It is recomputed, since the inputs may only now exist.  A stage that
+        raised never gets here, so it will be run again next time.
+
+        """
+        fp, _ = self.is_current(stage)
+        self._state['stages'][stage.name] = fp
+        self._save()
+
+
+def process_data():
+    import process
+    process.main()
+
+
+def compute_mi(mm=True, nproc=None):
+    from mi_computation import MiExperiment
+    MiExperiment(mm=mm).run(nproc=nproc)
+
+
+def compute_mm(outcsv, mutationsfname):
+    import comutation
+    comutation.write_mm(outcsv, mutationsfname=mutationsfname)
+
+
+def sort_csv(fname, outcsv, outdf):
+    import sort
+    sort.sort(fname, outcsv, outdf)
+
+
+def combine_em(empickle, mepickle, outcsv, outrows):
+    """Combine the em and me matrices into a full expression-mutation matrix.
+
+    Each of them only has half of the pairs.  The transpose of em lines up
+    with me (rows are expression genes, columns are mutation genes), so the
+    missing values in me are filled in from it.  The number of rows is written
+    to outrows, so cutoff_network() doesn't have to count them.
+
+    """
+    em = pd.read_pickle(empickle)
+    me = pd.read_pickle(mepickle)
+    full = me.combine_first(em.transpose())
+    series = full.stack()
+    series.sort_values(ascending=False, inplace=True)
+    series.to_csv(outcsv, header=False)
+    with open(outrows, 'w') as f:
+        print(len(series), file=f)
+
+
+def cutoff_network(sortedcsv, rowsfile, outcsv, cutoff=None, top=None):
+    """Write the edges of a sorted CSV above a cutoff.
+
+    Either an absolute mutual information cutoff or a top fraction of the
+    pairs may be given.  Since the CSV is sorted, this stops reading as soon as
+    it gets past the cutoff.  The number of rows (for the top fraction) comes
+    from the rowsfile written by combine_em().
+
+    """
+    limit = None
+    if top is not None:
+        with open(rowsfile, 'r') as f:
+            limit = int(int(f.read()) * top)
+
+    count = 0
+    with open(sortedcsv, 'r') as f, open(outcsv, 'w') as out:
+        for line in f:
+            src, dst, mi = [x.strip() for x in line.split(',')]
+            try:
+                value = float(mi)
+            except ValueError:
+                continue  # header line
+            if cutoff is not None and value < cutoff:
+                break
+            if limit is not None and count >= limit:
+                break
+            print('%s, %s, %s' % (src, dst, mi), file=out)
+            count += 1
+
+
+def translate_network(networkcsv, output, mapoutput):
+    import mfinder
+    with open(networkcsv, 'r') as f:
+        pairs = [tuple(x.strip() for x in line.split(',')[:2]) for line in f]
+    mfinder.translate(pairs, output, mapoutput)
+
+
+def stages(cutoff=None, top=0.0005, nproc=None):
+    """Return the stages of the standard workflow."""
+    result = [
+        Stage('process', process_data,
+              ['data/tcga/file_manifest.txt',
+               'data/tcga/curated-dna-sequencing.maf',
+               'data/cosmic/CosmicCompleteGeneExpression.tsv'],
+              ['data/expression.pickle', 'data/mutations.pickle',
+               'data/mutations.csv', 'data/patients.txt', 'data/genes.txt']),
+        Stage('mi', compute_mi,
+              ['data/expression.pickle', 'data/mutations.pickle'],
+              ['data/ee.csv', 'data/em.csv', 'data/me.csv'],
+              params={'mm': False}, options={'nproc': nproc}),
+        Stage('mm', compute_mm, ['data/mutations.pickle'], ['data/mm.csv'],
+              params={'outcsv': 'data/mm.csv',
+                      'mutationsfname': 'data/mutations.pickle'}),
+    ]
+    for kind in ('ee', 'em', 'me', 'mm'):
+        result.append(Stage(
+            'sort_' + kind, sort_csv, ['data/%s.csv' % kind],
+            ['data/%s_sorted.csv' % kind, 'data/%s_sorted.pickle' % kind],
+            params={'fname': 'data/%s.csv' % kind,
+                    'outcsv': 'data/%s_sorted.csv' % kind,
+                    'outdf': 'data/%s_sorted.pickle' % kind},
+            parallel=True))
+    result += [
+        Stage('combine_em', combine_em,
+              ['data/em_sorted.pickle', 'data/me_sorted.pickle'],
+              ['data/em_full_sorted.csv', 'data/em_full_sorted.rows'],
+              params={'empickle': 'data/em_sorted.pickle',
+                      'mepickle': 'data/me_sorted.pickle',
+                      'outcsv': 'data/em_full_sorted.csv',
+                      'outrows': 'data/em_full_sorted.rows'}),
+        Stage('network', cutoff_network,
+              ['data/em_full_sorted.csv', 'data/em_full_sorted.rows'],
+              ['data/network.csv'],
+              params={'sortedcsv': 'data/em_full_sorted.csv',
+                      'rowsfile': 'data/em_full_sorted.rows',
+                      'outcsv': 'data/network.csv', 'cutoff': cutoff,
+                      'top': None if cutoff is not None else top}),
+        Stage('mfinder', translate_network,
+              ['data/network.csv'],
+              ['data/network.mfinder', 'data/network.map'],
+              params={'networkcsv': 'data/network.csv',
+                      'output': 'data/network.mfinder',
+                      'mapoutput': 'data/network.map'}),
+    ]
+    return result
+
+
+def run(cutoff=None, top='0.0005', nproc=None):
+    """Run the standard workflow, skipping stages that are up to date."""
+    cutoff = None if cutoff is None else float(cutoff)
+    top = None if top is None else float(top)
+    nproc = None if nproc is None else int(nproc)
+    Pipeline(stages(cutoff, top, nproc)).run(nproc=nproc)
+
+
+if __name__ == '__main__':
+    from util import quick_main
+    quick_main()
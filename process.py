@@ -2,6 +2,7 @@
 """Routines for processing data from its initial form into its useful form."""
 
 import csv
+import os
 import pickle
 
 import pandas as pd
@@ -90,6 +91,25 @@ def expression(filename='data/cosmic/CosmicCompleteGeneExpression.tsv',
     """
     patients = patients if patients else mut_patients()
     genes = genes if genes else mut_genes()
+    return expression_cohorts({None: (patients, genes)}, filename)[None]
+
+
+def expression_cohorts(
+        cohorts, filename='data/cosmic/CosmicCompleteGeneExpression.tsv'):
+    """Return lists of COSMIC expression calls for several cohorts.
+
+    Since the COSMIC file has every TCGA patient, the expression values for
+    all the cohorts can be pulled out in a single pass over it.  The cohorts
+    argument maps each cohort name to its (patients, genes) sets, and the
+    result maps each cohort name to a list like expression() returns.
+
+    """
+    owners = {}
+    for name, (patients, genes) in cohorts.items():
+        for patient in patients:
+            owners.setdefault(patient, []).append(name)
+
+    ex_vals = {name: [] for name in cohorts}
     with open(filename) as f:
         reader = csv.reader(f, dialect='excel-tab')
         header = next(reader)
@@ -97,12 +117,14 @@ def expression(filename='data/cosmic/CosmicCompleteGeneExpression.tsv',
         gidx = header.index('GENE_NAME')
         ridx = header.index('REGULATION')
 
-        ex_vals = []
         for row in reader:
             patient = row[sidx][:12]
+            if patient not in owners:
+                continue
             gene = row[gidx]
-            if patient in patients and gene in genes:
-                ex_vals.append((patient, gene, row[ridx]))
+            for name in owners[patient]:
+                if gene in cohorts[name][1]:
+                    ex_vals[name].append((patient, gene, row[ridx]))
 
     return ex_vals
 
@@ -166,24 +188,14 @@ def restrict_mutations(pairset, patientset, geneset):
     return newset
 
 
-def main():
-    """Perform all the data processing steps.
+def finish(pairset, mut_pats, mut_gens, exp_list, outdir='data'):
+    """Turn the mutations and COSMIC expression list into the final data.
 
-    Read somatic mutations and get the initial patient/gene set.  Then, read
-    and filter the COSMIC data.  Then, restrict patients/genes to those
-    included in COSMIC.  Then, remove duplicate patients in COSMIC.  Then,
-    convert COSMIC data to a matrix, and save it.  Restrict somatic mutations
-    to the final patient anfd gene sets, and save it as a matrix and a list.
+    This is everything after reading the input files: restrict patients/genes
+    to those included in COSMIC, remove duplicate patients in COSMIC, and save
+    the expression and mutation matrices (and lists) into outdir.
 
     """
-    print('Getting patient and gene pairs from somatic mutation data...')
-    mut_pats = mut_patients()
-    mut_gens = mut_genes()
-    pairset = mutations()
-
-    print('Reading & filtering COSMIC expression data...')
-    exp_list = expression(patients=mut_pats, genes=mut_gens)
-
     print('Reshaping COSMIC expression data...')
     exp_pats, exp_genes, exp_values = zip(*exp_list)
 
@@ -195,24 +207,79 @@ def main():
     expmtrx, patients = deduplicate_expression(exp_list, patients, genes)
 
     print('Saving final COSMIC data...')
-    with open('data/expression.pickle', 'wb') as f:
+    with open(os.path.join(outdir, 'expression.pickle'), 'wb') as f:
         pickle.dump(expmtrx, f)
 
     print('Writing final patient and gene list.')
-    write_set(patients, 'data/patients.txt')
-    write_set(genes, 'data/genes.txt')
+    write_set(patients, os.path.join(outdir, 'patients.txt'))
+    write_set(genes, os.path.join(outdir, 'genes.txt'))
 
     print('Filtering somatic mutations by final patient and gene list...')
     newmutations = restrict_mutations(pairset, patients, genes)
     mutmtrx = matrix(newmutations, patients, genes)
 
     print('Writing final somatic mutation matrix and list.')
-    write_mutations(newmutations, 'data/mutations.csv')
-    with open('data/mutations.pickle', 'wb') as f:
+    write_mutations(newmutations, os.path.join(outdir, 'mutations.csv'))
+    with open(os.path.join(outdir, 'mutations.pickle'), 'wb') as f:
         pickle.dump(mutmtrx, f)
 
+
+def main():
+    """Perform all the data processing steps.
+
+    Read somatic mutations and get the initial patient/gene set.  Then, read
+    and filter the COSMIC data.  Then, restrict patients/genes to those
+    included in COSMIC.  Then, remove duplicate patients in COSMIC.  Then,
+    convert COSMIC data to a matrix, and save it.  Restrict somatic mutations
+    to the final patient anfd gene sets, and save it as a matrix and a list.
+
+    """
+    print('Getting patient and gene pairs from somatic mutation data...')
+    mut_pats = mut_patients()
+    mut_gens = mut_genes()
+    pairset = mutations()
+
+    print('Reading & filtering COSMIC expression data...')
+    exp_list = expression(patients=mut_pats, genes=mut_gens)
+
+    finish(pairset, mut_pats, mut_gens, exp_list)
+
+    print('Tada!  Data is ready to process.')
+
+
+def main_cohorts(*cohorts):
+    """Perform all the data processing steps for several cohorts.
+
+    Each cohort's TCGA files go in data/<cohort>/tcga/ (with the same names as
+    for BRCA), and its final data is written to data/<cohort>/.  The COSMIC
+    file is only read once for all of them.
+
+    """
+    mut_data = {}
+    for cohort in cohorts:
+        print('Getting patient and gene pairs for %s...' % cohort)
+        tcga = os.path.join('data', cohort, 'tcga')
+        maf = os.path.join(tcga, 'curated-dna-sequencing.maf')
+        mut_data[cohort] = (
+            mut_patients(os.path.join(tcga, 'file_manifest.txt')),
+            mut_genes(maf), mutations(maf))
+
+    print('Reading & filtering COSMIC expression data...')
+    exp_lists = expression_cohorts(
+        {cohort: (pats, gens) for cohort, (pats, gens, _) in mut_data.items()})
+
+    for cohort in cohorts:
+        print('Finishing %s...' % cohort)
+        mut_pats, mut_gens, pairset = mut_data[cohort]
+        finish(pairset, mut_pats, mut_gens, exp_lists[cohort],
+               os.path.join('data', cohort))
+
     print('Tada!  Data is ready to process.')
 
 
 if __name__ == '__main__':
-    main()
+    import sys
+    if len(sys.argv) > 1:
+        main_cohorts(*sys.argv[1:])
+    else:
+        main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Data processing inequality pruning for the mutual information network.
+
+This is the ARACNE trick: if genes A, B and C form a triangle in the network,
+the weakest of the three edges is most likely an indirect interaction (A talks
+to C through B), so it gets dropped.  Looking at every triangle is way too slow
+with the pandas matrices, so the thresholded edge list is turned into a compact
+CSR graph first, and the triangles are found by intersecting sorted neighbor
+lists.
+
+"""
+
+import csv
+import multiprocessing
+import os
+
+import numpy as np
+
+from experiment import Experiment
+from storage import BINARY, read_binary
+
+# Endpoint node types for each of the CSVs produced by MiExperiment.  In a row
+# "A, B, mi" of em.csv, A is an expression node and B is a mutation node.
+KINDS = {
+    'ee': ('E', 'E'),
+    'em': ('E', 'M'),
+    'me': ('M', 'E'),
+    'mm': ('M', 'M'),
+}
+
+
+def node(kind, gene):
+    """Return the name of a node, which includes its type (E or M)."""
+    return '%s:%s' % (kind, gene)
+
+
+def read_edges(fname, kinds=('E', 'E'), cutoff=None):
+    """Read an edge list from an experiment (or sorted) CSV.
+
+    Each row is "geneA, geneB, mi".  The node types for geneA and geneB are
+    given by kinds (see KINDS).  If a cutoff is given, only edges with mutual
+    information of at least that much are returned.  Binary results from
+    CohortMiExperiment (like ee.u16) are read with storage.read_binary().
+
+    """
+    if os.path.splitext(fname)[1][1:] in BINARY:
+        return [(node(kinds[0], a), node(kinds[1], b), mi)
+                for a, b, mi in read_binary(fname)
+                if cutoff is None or mi >= cutoff]
+    edges = []
+    with open(fname, 'r') as f:
+        reader = csv.reader(f, skipinitialspace=True)
+        for row in reader:
+            if len(row) < 3:
+                continue
+            try:
+                mi = float(row[2])
+            except ValueError:
+                continue  # header line
+            if cutoff is not None and mi < cutoff:
+                continue
+            edges.append((node(kinds[0], row[0]), node(kinds[1], row[1]), mi))
+    return edges
+
+
+def write_edges(edges, fname):
+    """Write a list of (src, dst, mi) edges to a CSV."""
+    with open(fname, 'w') as f:
+        for src, dst, mi in edges:
+            print('%s, %s, %f' % (src, dst, mi), file=f)
+
+
+def _intersect(a, b):
+    """Intersect two sorted arrays of unique values.
+
+    Returns the indices into a and into b of the common values.  Each element
+    of the shorter array is binary searched in the longer one, so this is
+    O(short * log(long)) rather than a full merge.
+
+    """
+    if len(a) > len(b):
+        ib, ia = _intersect(b, a)
+        return ia, ib
+    if len(a) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+    pos = np.searchsorted(b, a)
+    pos[pos == len(b)] = 0
+    hit = b[pos] == a
+    return np.nonzero(hit)[0], pos[hit]
+
+
+class Graph:
+    """An undirected, weighted graph stored in compressed sparse row form.
+
+    Vertices are relabelled by rank (ascending degree), and each edge is stored
+    only once, in the adjacency list of its lower ranked endpoint.  With that
+    orientation every triangle is found exactly once (from its lowest ranked
+    vertex), and the high degree hub genes have short adjacency lists, which
+    keeps the intersections cheap.
+
+    """
+
+    def __init__(self, edges):
+        # Deduplicate edges.  The em/me diagonals both contain E:A - M:A, for
+        # instance.
+        weights = {}
+        for src, dst, mi in edges:
+            if src == dst:
+                continue
+            key = (src, dst) if src < dst else (dst, src)
+            weights[key] = max(mi, weights.get(key, mi))
+
+        self.nodes = sorted(set(n for pair in weights for n in pair))
+        index = {n: i for i, n in enumerate(self.nodes)}
+        pairs = np.array([(index[a], index[b]) for a, b in weights],
+                         dtype=np.int64).reshape(-1, 2)
+        self.src = pairs[:, 0]
+        self.dst = pairs[:, 1]
+        self.weight = np.array(list(weights.values()), dtype=float)
+
+        nnodes = len(self.nodes)
+        degree = np.bincount(pairs.ravel(), minlength=nnodes)
+        order = np.lexsort((np.arange(nnodes), degree))
+        self.rank = np.empty(nnodes, dtype=np.int64)
+        self.rank[order] = np.arange(nnodes)
+
+        # Orient each edge from its lower to its higher ranked endpoint, and
+        # build the CSR arrays (sorted by rank within each row).
+        rsrc = self.rank[self.src]
+        rdst = self.rank[self.dst]
+        low = np.minimum(rsrc, rdst)
+        high = np.maximum(rsrc, rdst)
+        perm = np.lexsort((high, low))
+        self.indptr = np.zeros(nnodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(low, minlength=nnodes), out=self.indptr[1:])
+        self.indices = high[perm]
+        self.edge_ids = perm
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def neighbors(self, u):
+        """Return the higher ranked neighbors of u and the edge ids to them."""
+        start, end = self.indptr[u], self.indptr[u + 1]
+        return self.indices[start:end], self.edge_ids[start:end]
+
+    def triangles(self, start=0, stop=None):
+        """Yield the triangles whose lowest ranked vertex is in [start, stop).
+
+        Each yielded value is a (k, 3) array of edge ids: one row per triangle
+        u < v < w (by rank), with columns uv, uw, vw.
+
+        """
+        stop = len(self) if stop is None else stop
+        for u in range(start, stop):
+            nu, eu = self.neighbors(u)
+            for i in range(len(nu) - 1):
+                nv, ev = self.neighbors(nu[i])
+                iu, iv = _intersect(nu[i + 1:], nv)
+                if len(iu) == 0:
+                    continue
+                uv = np.repeat(eu[i], len(iu))
+                yield np.column_stack((uv, eu[i + 1 + iu], ev[iv]))
+
+    def partitions(self, count):
+        """Split the vertices into count ranges with similar triangle work.
+
+        The work for a vertex is roughly the square of its (oriented) out
+        degree, so the ranges are chosen to split the cumulative sum of that
+        evenly.
+
+        """
+        work = np.cumsum(np.diff(self.indptr) ** 2)
+        if len(work) == 0 or work[-1] == 0:
+            return [(0, len(self))]
+        cuts = np.searchsorted(work, work[-1] * np.arange(1, count) / count)
+        bounds = np.unique(np.concatenate(([0], cuts, [len(self)])))
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def weakest_edges(self, start=0, stop=None, tolerance=0.0):
+        """Return ids of edges the data processing inequality rejects.
+
+        Only triangles whose lowest ranked vertex is in [start, stop) are
+        examined.  In each triangle, the weakest edge is dropped when it is
+        smaller than the second weakest by more than the tolerance (a fraction,
+        like in ARACNE).  All decisions are based on the original weights, so
+        the result doesn't depend on the order the triangles are visited in.
+
+        """
+        dropped = []
+        for tri in self.triangles(start, stop):
+            w = self.weight[tri]
+            order = np.argsort(w, axis=1)
+            rows = np.arange(len(tri))
+            weakest = w[rows, order[:, 0]]
+            second = w[rows, order[:, 1]]
+            drop = weakest < second * (1 - tolerance)
+            dropped.append(tri[rows[drop], order[drop, 0]])
+        if not dropped:
+            return np.zeros(0, dtype=np.int64)
+        return np.unique(np.concatenate(dropped))
+
+    def edges(self, exclude=()):
+        """Return the (src, dst, mi) edge list, minus the excluded edge ids."""
+        keep = np.ones(len(self.weight), dtype=bool)
+        keep[np.asarray(exclude, dtype=np.int64)] = False
+        return [(self.nodes[s], self.nodes[d], w) for s, d, w in
+                zip(self.src[keep], self.dst[keep], self.weight[keep])]
+
+
+# The graph for DpiExperiment.  It is kept out of the experiment object, since
+# that gets pickled and sent along with every task.  Each worker gets it once,
+# through the pool initializer.
+graph = None
+
+
+def _set_graph(g):
+    global graph
+    graph = g
+
+
+class DpiExperiment(Experiment):
+    """Runs the triangle search in parallel over ranges of vertices."""
+
+    def __init__(self, g, tolerance=0.0, partitions=None):
+        global graph
+        super().__init__()
+        graph = g
+        self.tolerance = tolerance
+        self.dropped = set()
+        if not partitions:
+            partitions = 4 * multiprocessing.cpu_count()
+        self._params['partition'] = g.partitions(partitions)
+
+    def initializer(self):
+        return _set_graph, (graph,)
+
+    def task(self, config):
+        assert graph is not None, 'worker was not given the graph'
+        start, stop = config[0]
+        return graph.weakest_edges(start, stop, self.tolerance)
+
+    def result(self, retval):
+        self.dropped.update(retval.tolist())
+
+
+def prune(edges, tolerance=0.0, mp=True, nproc=None):
+    """Return the edge list with the indirect edges removed."""
+    g = Graph(edges)
+    experiment = DpiExperiment(g, tolerance)
+    experiment.run(mp=mp, nproc=nproc)
+    return g.edges(exclude=sorted(experiment.dropped))
+
+
+def prune_files(outcsv, cutoff=None, tolerance=0.0, nproc=None, **csvs):
+    """Read experiment CSVs, prune the network, and write the result.
+
+    The CSVs are given as keyword arguments named for their type, e.g.
+    ee=data/ee.csv em=data/em.csv.  Any combination of the four types may be
+    given, so the network can be E-E only, E-M only, or mixed.
+
+    """
+    cutoff = None if cutoff is None else float(cutoff)
+    nproc = None if nproc is None else int(nproc)
+    edges = []
+    for kind, fname in csvs.items():
+        print('Reading %s edges from %s...' % (kind, fname))
+        edges.extend(read_edges(fname, KINDS[kind], cutoff))
+
+    print('Pruning %d edges...' % len(edges))
+    pruned = prune(edges, float(tolerance), nproc=nproc)
+
+    print('Kept %d edges.  Writing to %s.' % (len(pruned), outcsv))
+    write_edges(pruned, outcsv)
+
+
+if __name__ == '__main__':
+    from util import quick_main
+    quick_main()
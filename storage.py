@@ -1,52 +1,89 @@
 """Storage of data."""
 
+import os
 import pickle
 
 import numpy as np
 import pandas as pd
 
-_eecsv = 'data/ee.csv'
-_emcsv = 'data/em.csv'
-_mecsv = 'data/me.csv'
-_mmcsv = 'data/mm.csv'
+import mathfunc as mf
+
+# Value types for binary results (see Storage), by file extension.
+BINARY = {'f32': np.float32, 'u16': np.uint16}
+
+# Name of the gene list written next to binary results.
+GENES_FILE = 'mi_genes.txt'
 
 
 class Storage:
-    def __init__(self, genes):
-        self._ee = pd.DataFrame(index=genes, columns=genes, dtype=float)
-        self._em = pd.DataFrame(index=genes, columns=genes, dtype=float)
-        self._me = pd.DataFrame(index=genes, columns=genes, dtype=float)
-        self._mm = pd.DataFrame(index=genes, columns=genes, dtype=float)
+    def __init__(self, genes, directory='data', frames=True, binary=None):
+        # With several cohorts, the full DataFrames would take way too much
+        # memory, so they can be turned off (leaving just the CSVs).
+        self.frames = frames
+        # With binary set to 'f32' or 'u16', the results go to ee.f32 (etc.)
+        # instead of the CSVs.  Each gene's series is written as its index
+        # (an int32) followed by the values for it and every earlier gene, as
+        # float32 or as uint16 codes from mathfunc.quantize().  Missing values
+        # are written too (as NaN or QUANT_MISSING), so the rows line up with
+        # the gene list, which goes to GENES_FILE.  Use read_binary() to get
+        # the pairs back.
+        self.genes = pd.Index(genes)
+        self.binary = binary
+        if frames:
+            self._ee = pd.DataFrame(index=genes, columns=genes, dtype=float)
+            self._em = pd.DataFrame(index=genes, columns=genes, dtype=float)
+            self._me = pd.DataFrame(index=genes, columns=genes, dtype=float)
+            self._mm = pd.DataFrame(index=genes, columns=genes, dtype=float)
 
-        self.eepickle = 'data/ee.pickle'
-        self.empickle = 'data/em.pickle'
-        self.mepickle = 'data/me.pickle'
-        self.mmpickle = 'data/mm.pickle'
+        ext = binary or 'csv'
+        self.eecsv = os.path.join(directory, 'ee.' + ext)
+        self.emcsv = os.path.join(directory, 'em.' + ext)
+        self.mecsv = os.path.join(directory, 'me.' + ext)
+        self.mmcsv = os.path.join(directory, 'mm.' + ext)
+        if binary:
+            with open(os.path.join(directory, GENES_FILE), 'w') as f:
+                print('\n'.join(self.genes), file=f)
+
+        self.eepickle = os.path.join(directory, 'ee.pickle')
+        self.empickle = os.path.join(directory, 'em.pickle')
+        self.mepickle = os.path.join(directory, 'me.pickle')
+        self.mmpickle = os.path.join(directory, 'mm.pickle')
 
     def append(self, fn, series):
         gene = series.name
+        if self.binary:
+            with open(fn, 'ab') as f:
+                np.int32(self.genes.get_loc(gene)).tofile(f)
+                series.values.astype(BINARY[self.binary]).tofile(f)
+            return
         with open(fn, 'a') as f:
             for geneB in series.index:
                 if not np.isnan(series[geneB]):
                     print('%s, %s, %f' % (gene, geneB, series[geneB]), file=f)
 
     def store_ee(self, series):
-        self._ee[series.name] = series
-        self.append(_eecsv, series)
+        if self.frames:
+            self._ee[series.name] = series
+        self.append(self.eecsv, series)
 
     def store_em(self, series):
-        self._em[series.name] = series
-        self.append(_emcsv, series)
+        if self.frames:
+            self._em[series.name] = series
+        self.append(self.emcsv, series)
 
     def store_me(self, series):
-        self._me[series.name] = series
-        self.append(_mecsv, series)
+        if self.frames:
+            self._me[series.name] = series
+        self.append(self.mecsv, series)
 
     def store_mm(self, series):
-        self._mm[series.name] = series
-        self.append(_mmcsv, series)
+        if self.frames:
+            self._mm[series.name] = series
+        self.append(self.mmcsv, series)
 
     def save(self):
+        if not self.frames:
+            return
         with open(self.eepickle, 'wb') as f:
             pickle.dump(self._ee, f)
         with open(self.empickle, 'wb') as f:
@@ -55,3 +92,27 @@ class Storage:
             pickle.dump(self._me, f)
         with open(self.mmpickle, 'wb') as f:
             pickle.dump(self._mm, f)
+
+
+def read_binary(fname):
+    """Yield the (geneA, geneB, mi) rows of a binary result file.
+
+    This is the binary counterpart of reading a row of an experiment CSV.  The
+    genes come from the GENES_FILE in the same directory, uint16 codes are
+    turned back into bits, and missing values are skipped.
+
+    """
+    dtype = BINARY[os.path.splitext(fname)[1][1:]]
+    with open(os.path.join(os.path.dirname(fname), GENES_FILE)) as f:
+        genes = f.read().splitlines()
+    with open(fname, 'rb') as f:
+        while True:
+            head = np.fromfile(f, dtype=np.int32, count=1)
+            if len(head) == 0:
+                break
+            geneidx = int(head[0])
+            values = np.fromfile(f, dtype=dtype, count=geneidx + 1)
+            if dtype == np.uint16:
+                values = mf.dequantize(values)
+            for geneB in np.nonzero(~np.isnan(values))[0]:
+                yield genes[geneidx], genes[geneB], float(values[geneB])